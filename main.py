@@ -1,11 +1,13 @@
 import streamlit as st
 import sqlite3
-import pandas as pd
 from datetime import date
-import re
-from io import StringIO
+import contextlib
+import itertools
+import threading
 import os
+import queue
 from dotenv import load_dotenv
+from utils import create_slug
 
 # Load environment variables from .env file
 load_dotenv()
@@ -13,16 +15,106 @@ load_dotenv()
 # Get the connection string from the .env file
 conn_string = os.getenv('DATABASE_PATH')
 
-# Utility functions
-def create_slug(title):
-    """Create a slug from the title"""
-    # Convert to lowercase and replace spaces with hyphens
-    slug = title.lower()
-    # Remove special characters
-    slug = re.sub(r'[^a-z0-9\s-]', '', slug)
-    # Replace spaces with hyphens
-    slug = re.sub(r'\s+', '-', slug)
-    return slug
+# SQL statements used by the database helpers
+_SQL_SELECT_ALL = 'SELECT id, titolo, slug, data, tags FROM articoli ORDER BY data DESC'
+_SQL_SELECT_SEARCH = '''
+SELECT id, titolo, slug, data, tags FROM articoli
+WHERE titolo LIKE ? ESCAPE '\\' OR tags LIKE ? ESCAPE '\\'
+ORDER BY data DESC
+'''
+_SQL_SELECT_SEARCH_CASEFOLD = '''
+SELECT id, titolo, slug, data, tags FROM articoli
+WHERE instr(casefold(titolo), ?) > 0 OR instr(casefold(tags), ?) > 0
+ORDER BY data DESC
+'''
+_SQL_SELECT_ID = 'SELECT * FROM articoli WHERE id=?'
+_SQL_SLUG_EXISTS = 'SELECT 1 FROM articoli WHERE slug=? LIMIT 1'
+_SQL_INSERT = '''
+INSERT INTO articoli (titolo, slug, data, tags, contenuto)
+VALUES (?, ?, ?, ?, ?)
+'''
+_SQL_UPDATE = '''
+UPDATE articoli
+SET titolo=?, slug=?, tags=?, contenuto=?
+WHERE id=?
+'''
+
+def casefold(value):
+    """SQL function used for case insensitive search of non ASCII text"""
+    return value.casefold() if isinstance(value, str) else value
+
+def connect():
+    """Open a new connection to the database"""
+    conn = sqlite3.connect(conn_string, check_same_thread=False, isolation_level=None)
+    # These settings are per connection, journal_mode is set once in init_db
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA mmap_size=268435456')
+    conn.execute('PRAGMA cache_size=-20000')
+    conn.row_factory = sqlite3.Row
+    conn.create_function('casefold', 1, casefold, deterministic=True)
+    return conn
+
+@st.cache_resource
+def get_conn():
+    """Return the connection used for writes, shared across reruns and sessions"""
+    return connect()
+
+@st.cache_resource
+def get_read_pool():
+    """Return the pool of idle read connections, shared across reruns and sessions"""
+    return queue.SimpleQueue()
+
+@contextlib.contextmanager
+def read_connection():
+    """Borrow a read connection from the pool
+
+    Reads never use the write connection, so they only see committed data
+    and, thanks to WAL, don't wait for a write in progress.
+    """
+    pool = get_read_pool()
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = connect()
+    try:
+        yield conn
+    finally:
+        pool.put(conn)
+
+@st.cache_resource
+def get_write_lock():
+    """Return the lock serializing write transactions on the write connection"""
+    return threading.Lock()
+
+@contextlib.contextmanager
+def write_transaction():
+    """Run the enclosed statements in a single transaction on the write connection
+
+    The transaction is rolled back on any error, so a failed write never
+    leaves the connection stuck in an open transaction for other sessions.
+    """
+    conn = get_conn()
+    with get_write_lock():
+        conn.execute('BEGIN')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+
+def get_db_mtime():
+    """Return the last modification time of the database
+
+    In WAL mode writes land in the -wal file until a checkpoint,
+    so its mtime is taken into account as well.
+    """
+    mtimes = [os.path.getmtime(conn_string)]
+    if os.path.exists(conn_string + '-wal'):
+        mtimes.append(os.path.getmtime(conn_string + '-wal'))
+    return max(mtimes)
 
 def init_db():
     """Initialize the database if it doesn't exist"""
@@ -30,9 +122,8 @@ def init_db():
         st.error("Database path not configured. Check the .env file")
         st.stop()
         
-    conn = sqlite3.connect(conn_string)
-    c = conn.cursor()
-    c.execute('''
+    conn = get_conn()
+    conn.execute('''
     CREATE TABLE IF NOT EXISTS articoli (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         titolo TEXT NOT NULL,
@@ -42,70 +133,95 @@ def init_db():
         contenuto TEXT
     )
     ''')
-    conn.commit()
-    conn.close()
+    # Lets the article list be read in date order without sorting
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_articoli_data ON articoli(data DESC)')
+    # WAL lets readers and the writer work concurrently; the mode is persistent
+    conn.execute('PRAGMA journal_mode=WAL')
 
-def get_articles():
-    """Retrieve all articles from the database"""
-    conn = sqlite3.connect(conn_string)
-    df = pd.read_sql('SELECT * FROM articoli ORDER BY data DESC', conn)
-    conn.close()
-    return df
+@st.cache_data(max_entries=32, show_spinner=False)
+def get_articles(mtime, search=None):
+    """Retrieve the articles from the database, without their content
+
+    If search is given, only the articles whose title or tags contain it
+    (case insensitive) are returned.
+    The mtime of the database file is only used as cache key, so the
+    table is read again only when the database has actually changed.
+    """
+    with read_connection() as conn:
+        if search and search.isascii():
+            # LIKE ignores case for ASCII and runs entirely inside SQLite;
+            # wildcards are escaped so the search text is matched literally
+            pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            rows = conn.execute(_SQL_SELECT_SEARCH, (pattern, pattern)).fetchall()
+        elif search:
+            # Slower, calls back into Python for every row, but also
+            # ignores case for non ASCII letters (e.g. 'città' and 'CITTÀ')
+            search = search.casefold()
+            rows = conn.execute(_SQL_SELECT_SEARCH_CASEFOLD, (search, search)).fetchall()
+        else:
+            rows = conn.execute(_SQL_SELECT_ALL).fetchall()
+    # sqlite3.Row can't be pickled by st.cache_data, plain dicts can
+    return [dict(row) for row in rows]
+
+@st.cache_data(ttl=5, show_spinner=False)
+def slug_exists(slug, mtime):
+    """Check whether an article with the given slug already exists
+
+    The mtime of the database is only used as cache key, like in get_articles.
+    """
+    with read_connection() as conn:
+        return conn.execute(_SQL_SLUG_EXISTS, (slug,)).fetchone() is not None
 
 def add_article(titolo, tags, contenuto):
     """Add a new article to the database"""
     slug = create_slug(titolo)
     today_date = date.today().strftime('%Y-%m-%d')
     
-    conn = sqlite3.connect(conn_string)
-    c = conn.cursor()
     try:
-        c.execute('''
-        INSERT INTO articoli (titolo, slug, data, tags, contenuto)
-        VALUES (?, ?, ?, ?, ?)
-        ''', (titolo, slug, today_date, tags, contenuto))
-        conn.commit()
-        result = True
+        with write_transaction() as conn:
+            conn.execute(_SQL_INSERT, (titolo, slug, today_date, tags, contenuto))
+    except sqlite3.IntegrityError:
+        return False
+    get_articles.clear()
+    return True
+
+def add_articles_bulk(rows):
+    """Add several articles to the database in a single transaction
+
+    rows is an iterable of (titolo, tags, contenuto) tuples. If any slug
+    is a duplicate, none of the articles are added.
+    """
+    today_date = date.today().strftime('%Y-%m-%d')
+    params = [(titolo, create_slug(titolo), today_date, tags, contenuto)
+              for titolo, tags, contenuto in rows]
+    
+    try:
+        with write_transaction() as conn:
+            conn.executemany(_SQL_INSERT, params)
     except sqlite3.IntegrityError:
-        result = False
-    conn.close()
-    return result
+        return False
+    get_articles.clear()
+    return True
 
 def update_article(id, titolo, tags, contenuto):
     """Update an existing article"""
     slug = create_slug(titolo)
     
     # Note: we don't update the 'data' field to maintain the original publication date
-    conn = sqlite3.connect(conn_string)
-    c = conn.cursor()
     try:
-        c.execute('''
-        UPDATE articoli 
-        SET titolo=?, slug=?, tags=?, contenuto=?
-        WHERE id=?
-        ''', (titolo, slug, tags, contenuto, id))
-        conn.commit()
-        result = True
+        with write_transaction() as conn:
+            conn.execute(_SQL_UPDATE, (titolo, slug, tags, contenuto, id))
     except sqlite3.IntegrityError:
-        result = False
-    conn.close()
-    return result
+        return False
+    get_articles.clear()
+    return True
 
 def get_article_by_id(id):
     """Retrieve a specific article from the database"""
-    conn = sqlite3.connect(conn_string)
-    c = conn.cursor()
-    c.execute('SELECT * FROM articoli WHERE id=?', (id,))
-    result = c.fetchone()
-    conn.close()
-    
-    if result:
-        # Create a dictionary from the results
-        columns = ['id', 'titolo', 'slug', 'data', 'tags', 'contenuto']
-        article = {columns[i]: result[i] for i in range(len(columns))}
-        return article
-    else:
-        return None
+    with read_connection() as conn:
+        row = conn.execute(_SQL_SELECT_ID, (id,)).fetchone()
+    # The connection returns sqlite3.Row objects, keyed by column name
+    return dict(row) if row else None
 
 # Page settings
 st.set_page_config(
@@ -124,67 +240,63 @@ if not conn_string:
 # Initialize the database
 init_db()
 
-# Initialize session variables if they don't exist
-if 'page' not in st.session_state:
-    st.session_state['page'] = 'list'
-
-# Function to determine which page to display
-def display_page():
-    # If we're in edit mode, show the edit page
-    if 'edit_id' in st.session_state:
-        display_edit_page()
-    # Otherwise, show the page selected from the sidebar
-    elif st.session_state['page'] == 'list':
-        display_list_page()
-    elif st.session_state['page'] == 'new':
-        display_new_page()
-
 # Page: Article List
 def display_list_page():
+    # Leaving the edit page ends edit mode
+    st.session_state.pop('edit_id', None)
     st.title("Article Management")
-    
+    display_articles_grid()
+
+# Search box and article grid, rerun on their own when the search changes
+@st.fragment
+def display_articles_grid():
     # Retrieve articles
-    df = get_articles()
+    mtime = get_db_mtime()
+    articles = get_articles(mtime)
     
-    if not df.empty:
+    if articles:
         # Show the table of articles
-        st.write(f"Total articles: {len(df)}")
+        st.write(f"Total articles: {len(articles)}")
         
         # Use a search box to filter articles
         search = st.text_input("Search articles by title or tag:")
         
         if search:
-            filtered_df = df[df['titolo'].str.contains(search, case=False) | 
-                             df['tags'].str.contains(search, case=False)]
+            records = get_articles(mtime, search)
         else:
-            filtered_df = df
+            records = articles
         
         # Show articles in a grid layout with 3 articles per row
         col_count = 3
         
+        titles = {article['id']: article['titolo'] for article in records}
+        
+        # A single selector instead of one edit button per article
+        selected_id = st.selectbox(
+            "✏️ Edit article",
+            options=list(titles),
+            format_func=titles.get,
+            index=None,
+            placeholder="Choose an article to edit",
+        )
+        if selected_id is not None:
+            st.session_state['edit_id'] = int(selected_id)
+            st.switch_page(edit_page)
+        
         # Add some space above the grid
         st.write("")
         
-        for i in range(0, len(filtered_df), col_count):
+        for row in itertools.zip_longest(*[iter(records)] * col_count):
             cols = st.columns(col_count)
-            for j in range(col_count):
-                if i + j < len(filtered_df):
-                    article = filtered_df.iloc[i + j]
-                    with cols[j]:
+            for col, article in zip(cols, row):
+                if article is not None:
+                    with col:
                         # Add a container with border and padding
                         with st.container():
                             st.subheader(article['titolo'])
                             st.caption(f"Date: {article['data']}")
                             st.caption(f"Tags: {article['tags']}")
                             
-                            # Additional space before the button
-                            st.write("")
-                            
-                            # Only edit button
-                            if st.button("✏️ Edit", key=f"edit_{article['id']}"):
-                                st.session_state['edit_id'] = int(article['id'])
-                                st.rerun()
-                            
                             # Space after each article
                             st.write("")
             
@@ -195,6 +307,8 @@ def display_list_page():
 
 # Page: New Article
 def display_new_page():
+    # Leaving the edit page ends edit mode
+    st.session_state.pop('edit_id', None)
     st.title("New Article")
     
     # Variables to store form values
@@ -220,12 +334,14 @@ def display_new_page():
     if form_submitted:
         if not titolo:
             st.error("Title cannot be empty!")
+        # Avoid a failing INSERT when the duplicate is already known
+        elif slug_exists(create_slug(titolo), get_db_mtime()):
+            st.error("An article with this slug already exists!")
         else:
             if add_article(titolo, tags, contenuto):
                 st.success("Article created successfully!")
-                # Change page and force rerun
-                st.session_state['page'] = 'list'
-                st.rerun()
+                # Go back to the article list
+                st.switch_page(list_page)
             else:
                 st.error("Error creating the article. Duplicate slug?")
 
@@ -233,15 +349,26 @@ def display_new_page():
 def display_edit_page():
     st.title("Edit Article")
     
+    # Highlight in the sidebar that we're editing
+    st.sidebar.info("✏️ Article edit mode")
+    
+    # Button to return to the list from the sidebar
+    if st.sidebar.button("Back to article list"):
+        st.session_state.pop('edit_id', None)
+        st.switch_page(list_page)
+    
     # Retrieve the article from the database
-    article_id = st.session_state['edit_id']
-    article = get_article_by_id(article_id)
+    article_id = st.session_state.get('edit_id')
+    article = get_article_by_id(article_id) if article_id is not None else None
     
     if not article:
-        st.error(f"Article with ID {article_id} not found in the database.")
+        if article_id is None:
+            st.info("No article selected. Choose one to edit from the article list.")
+        else:
+            st.error(f"Article with ID {article_id} not found in the database.")
         if st.button("Back to list"):
             st.session_state.pop('edit_id', None)
-            st.rerun()
+            st.switch_page(list_page)
     else:
         # Variables to store form values
         form_submitted = False
@@ -270,37 +397,26 @@ def display_edit_page():
                     st.success("Article updated successfully!")
                     # Remove the edit ID and return to the list automatically
                     st.session_state.pop('edit_id', None)
-                    st.session_state['page'] = 'list'
-                    st.rerun()
+                    st.switch_page(list_page)
                 else:
                     st.error("Error updating the article. Duplicate slug?")
         
         # Button to go back
         if st.button("Back to list"):
             st.session_state.pop('edit_id', None)
-            st.rerun()
+            st.switch_page(list_page)
 
-# Sidebar for navigation
-st.sidebar.title("Blog CMS")
+# Pages, the sidebar menu is built by st.navigation
+list_page = st.Page(display_list_page, title="Article List", default=True)
+new_page = st.Page(display_new_page, title="New Article", url_path="new")
+edit_page = st.Page(display_edit_page, title="Edit Article", icon="✏️", url_path="edit")
 
-# Page selection in the sidebar (only if we're not editing)
-if 'edit_id' not in st.session_state:
-    page_options = ["Article List", "New Article"]
-    selected_page = st.sidebar.radio("Navigation", page_options)
-    
-    # Map the selection to the page key
-    if selected_page == "Article List":
-        st.session_state['page'] = 'list'
-    elif selected_page == "New Article":
-        st.session_state['page'] = 'new'
-else:
-    # If we're in edit mode, highlight that we're editing
-    st.sidebar.info("✏️ Article edit mode")
-    
-    # Button to return to the list from the sidebar
-    if st.sidebar.button("Back to article list"):
-        st.session_state.pop('edit_id', None)
-        st.rerun()
+# The edit page is only listed while an article is being edited
+pages = [list_page, new_page]
+if 'edit_id' in st.session_state:
+    pages.append(edit_page)
+
+st.sidebar.title("Blog CMS")
 
 # Show the current page
-display_page()
\ No newline at end of file
+st.navigation(pages).run()
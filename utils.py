@@ -0,0 +1,35 @@
+import functools
+import re
+import string
+
+# Kept out of main.py: Streamlit re-executes the script on every rerun,
+# while imported modules are loaded once per process, so the compiled
+# patterns and the create_slug cache survive between reruns.
+
+# Patterns used by create_slug, compiled once
+_SLUG_STRIP = re.compile(r'[^a-z0-9\s-]')
+_SLUG_SPACE = re.compile(r'\s+')
+
+# ASCII characters matched by \s: string.whitespace plus \x1c-\x1f
+_ASCII_SPACES = string.whitespace + '\x1c\x1d\x1e\x1f'
+
+# Translation table for ASCII titles: lowercases letters, turns whitespace
+# into plain spaces and drops everything that is not allowed in a slug
+_SLUG_TABLE = str.maketrans(
+    string.ascii_uppercase + _ASCII_SPACES,
+    string.ascii_lowercase + ' ' * len(_ASCII_SPACES),
+    ''.join(c for c in map(chr, range(128))
+            if not (c.isalnum() or c.isspace() or c == '-')),
+)
+
+@functools.lru_cache(maxsize=1024)
+def create_slug(title):
+    """Create a slug from the title"""
+    if title.isascii():
+        # Fast path: a single pass with str.translate, then collapse spaces
+        slug = title.translate(_SLUG_TABLE)
+        while '  ' in slug:
+            slug = slug.replace('  ', ' ')
+        return slug.replace(' ', '-')
+    # Lowercase, remove special characters, then replace spaces with hyphens
+    return _SLUG_SPACE.sub('-', _SLUG_STRIP.sub('', title.lower()))